@@ -1,13 +1,66 @@
-import dateutil.parser
+from __future__ import annotations
 from datetime import datetime, timedelta
-import yfinance as yf
-from typing import List, Dict, Union
+from concurrent.futures import ThreadPoolExecutor
+import logging
+from typing import List, Dict, Set, Tuple, Union, TYPE_CHECKING
 import json
 import os
 import sqlite3
-import pandas as pd
 import re
 
+if TYPE_CHECKING:
+    # yfinance and pandas (and requests, through them) are imported by the functions that need them,
+    # so that code paths not downloading data don't pay their import cost
+    import pandas as pd
+    import requests
+
+try:
+    # Faster JSON parser, used when available
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    # Streaming JSON parser, used when available so that large files are not loaded in memory at once
+    import ijson
+except ImportError:
+    ijson = None
+
+logger = logging.getLogger(__name__)
+
+# Tickers checked on Yahoo Finance start with a letter and contain only letters and digits
+_TICKER_RE = re.compile(r'^[A-Za-z][A-Za-z0-9]*$')
+
+# Intervals stored with a 'Datetime' column and with a 'Date' column
+_INTRADAY_INTERVALS = {'1m', '2m', '5m', '15m', '30m', '60m', '90m', '1h'}
+_DAILY_INTERVALS = {'1d', '5d', '1wk', '1mo', '3mo'}
+
+# Column definitions of the stock tables for each group of intervals
+_INTRADAY_COLUMNS = 'Datetime TEXT PRIMARY KEY, Open REAL, High REAL, Low REAL, Close REAL, "Adj Close" REAL, Volume INTEGER'
+_DAILY_COLUMNS = _INTRADAY_COLUMNS.replace('Datetime', 'Date')
+
+# Table names are interpolated into SQL statements, so only letters, digits, '_', '$' and '-' are allowed
+_IDENTIFIER_RE = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_$\-]*$')
+
+# yfinance records the errors of each ticker as the repr of the exception raised, and these ones are
+# network failures worth retrying, unlike e.g. 'symbol may be delisted'
+_NETWORK_ERROR_RE = re.compile(
+    r'\b(ConnectionError|ConnectTimeout|ReadTimeout|Timeout|ProxyError|SSLError|ChunkedEncodingError)\b')
+
+
+class DownloadError(Exception):
+    """
+    Raised when the data of some tables could not be downloaded because of network errors, which is worth
+    retrying later.
+
+    Attributes:
+    - tables (List[str]): Names of the tables whose data could not be downloaded.
+    """
+
+    def __init__(self, message: str, tables: List[str]):
+        super().__init__(message)
+        self.tables = tables
+
 
 def get_stocks_tickers_and_intervals(json_file_path: str) -> List[str]:
     """
@@ -20,189 +73,353 @@ def get_stocks_tickers_and_intervals(json_file_path: str) -> List[str]:
     - List[str]: A list of combinations in the format ["TICKER_INTERVAL", ...].
     """
 
+    # Initialize an empty list to store combinations
+    result = []
+
     try:
         # Try to open and read the JSON file
-        with open(json_file_path, 'r') as file:
-            data = json.load(file)
+        with open(json_file_path, 'rb') as file:
+            if ijson is not None:
+                # Stream the entries of the top-level list, parsing one entry at a time
+                data = ijson.items(file, 'item')
+            else:
+                data = orjson.loads(file.read()) if orjson is not None else json.load(file)
+
+            # Iterate through each entry in the JSON data
+            for entry in data:
+                # Extract intervals and stocks from the entry
+                intervals = entry.get("intervals", [])
+                stocks = entry.get("stocks", [])
+
+                # Generate combinations of stock tickers and intervals
+                result += [stock + "_" + interval for stock in stocks for interval in intervals]
     except FileNotFoundError:
         # If the file is not found, return an empty list
         return []
 
-    # Initialize an empty list to store combinations
-    result = []
-
-    # Iterate through each entry in the JSON data
-    for entry in data:
-        # Extract intervals and stocks from the entry
-        intervals = entry.get("intervals", [])
-        stocks = entry.get("stocks", [])
-
-        # Generate combinations of stock tickers and intervals
-        for stock in stocks:
-            for interval in intervals:
-                result.append(f"{stock}_{interval}")
-
     # Return the list of combinations
     return result
 
 
-def is_ticker_available(ticker: str) -> bool:
+def filter_available_tickers(ticker_intervals: List[str], batch_size: int = 200, max_workers: int = 32,
+                             session: requests.Session = None) -> List[str]:
     """
-    Verify if a stock ticker is available on Yahoo Finance.
+    Filter a list of stock ticker intervals to include only those available on Yahoo Finance.
 
     Parameters:
-    - ticker (str): Stock ticker symbol.
+    - ticker_intervals (List[str]): List of stock ticker intervals (e.g., 'AAPL_1h').
+    - batch_size (int): Maximum number of tickers checked per Yahoo Finance request. Default value: 200
+    - max_workers (int): Maximum number of tickers checked concurrently. Default value: 32
+    - session (requests.Session): HTTP session to reuse across requests. Default value: None
 
     Returns:
-    - bool: True if the ticker is available, False otherwise.
+    - List[str]: Filtered list of ticker intervals that are available on Yahoo Finance.
     """
-    try:
-        # Create a Ticker object
-        stock = yf.Ticker(ticker)
 
-        # Download minimal data (1 month) to quickly check if the ticker is available
-        data = stock.history(period='1mo')
+    # Unique tickers, keeping their order of appearance
+    tickers = list(dict.fromkeys(item.split('_', 1)[0] for item in ticker_intervals))
 
-        # Check if data is not empty
-        return not data.empty
-    except Exception as e:
-        # Handle exceptions, print the error, and return False
-        print(f"Error: {e}")
-        return False
+    # Removes all items from a list that start with a number or contain any character that is not a letter or digit
+    tickers = [item for item in tickers if _TICKER_RE.match(item)]
 
+    # Download minimal data (last week) for each batch of tickers to quickly check which ones are available
+    start_date = (datetime.now() - timedelta(days=7)).strftime("%Y-%m-%d")
+    available_tickers = set()
+    for i in range(0, len(tickers), batch_size):
+        batch = tickers[i:i + batch_size]
+        data = download_stocks_data(batch, '1d', start_date, max_workers, session)
+        available_tickers.update(
+            ticker for ticker in batch if not data[ticker].empty)
 
-def filter_available_tickers(ticker_intervals: List[str]) -> List[str]:
-    """
-    Filter a list of stock ticker intervals to include only those available on Yahoo Finance.
+    available_ticker_intervals = [
+        item for item in ticker_intervals if item.split('_')[0] in available_tickers]
+    return available_ticker_intervals
 
-    Parameters:
-    - ticker_intervals (List[str]): List of stock ticker intervals (e.g., 'AAPL_1h').
 
-    Returns:
-    - List[str]: Filtered list of ticker intervals that are available on Yahoo Finance.
+def _quote_identifier(name: str) -> str:
     """
+    Quote a table or column name so it can be safely interpolated into a SQL statement.
 
-    tickers = [item.split('_')[0] for item in ticker_intervals]
+    Parameters:
+    - name (str): Table or column name.
 
-    # Removes all items from a list that contain any character that is not a letter or digit.
-    tickers = [item for item in tickers if re.match(r'^[a-zA-Z0-9]+$', item)]
+    Returns:
+    - str: The name enclosed in double quotes.
 
-    # Removes all items from a list that start with a number
-    tickers = [item for item in tickers if not item[0].isdigit()]
+    Raises:
+    - ValueError: If the name contains characters that are not allowed in identifiers.
+    """
 
-    # Inline the get_ticker_from_interval logic in the list comprehension
-    available_ticker_intervals = [
-        ticker for ticker in tickers if is_ticker_available(ticker)]
-    return available_ticker_intervals
+    if not _IDENTIFIER_RE.match(name):
+        raise ValueError(f"Invalid identifier '{name}'.")
+    return f'"{name}"'
 
 
-def create_or_connect_to_database(db_file_path: str) -> None:
+def create_or_connect_to_database(db_file_path: str) -> sqlite3.Connection:
     """
-    Check if the SQLite database file exists, and create it if it doesn't.
+    Check if the SQLite database file exists, create it if it doesn't, and connect to it.
+
+    The connection is tuned for bulk writes and meant to be shared by the other functions of this module.
+    A 'meta' table, used by get_meta_value and set_meta_values to record the last successful run, is also
+    created in the database if it doesn't exist.
 
     Parameters:
     - db_file_path (str): The path to the SQLite database file.
+
+    Returns:
+    - sqlite3.Connection: Connection to the SQLite database, to be closed by the caller.
     """
 
     # Check if the database file exists
-    if not os.path.exists(db_file_path):
-        # If the file doesn't exist, create it
-        # Create a connection to the database
-        conn = sqlite3.connect(db_file_path)
-        conn.close()  # Close the connection
-        print(f"Database file '{db_file_path}' created successfully.")
+    database_exists = os.path.exists(db_file_path)
+
+    # Create a connection to the database, which creates the file if it doesn't exist.
+    # Wait up to 30 seconds for locks held by other processes instead of failing with 'database is locked',
+    # starting with the switch to WAL below, which needs a lock the first time
+    conn = sqlite3.connect(db_file_path, timeout=30)
+
+    if not database_exists:
+        logger.info("Database file '%s' created successfully.", db_file_path)
     else:
-        # If the file already exists, print a message
-        print(f"Database file '{db_file_path}' already exists.")
+        # If the file already exists, log a message
+        logger.info("Database file '%s' already exists.", db_file_path)
+
+    # Tune SQLite for bulk writes: WAL journal, fewer fsyncs, a larger page cache and memory-mapped reads
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-65536")
+    conn.execute("PRAGMA mmap_size=268435456")
+
+    # Key/value table recording the state of the last successful run
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    return conn
+
+
+def get_meta_value(conn: sqlite3.Connection, key: str) -> Union[str, None]:
+    """
+    Get a value from the meta table of the SQLite database.
+
+    Parameters:
+    - conn (sqlite3.Connection): Connection to the SQLite database.
+    - key (str): Key of the value.
+
+    Returns:
+    - Union[str, None]: The value, or None if the key is not stored.
+    """
+
+    row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row is not None else None
 
 
-def create_stock_tables(db_file_path: str, tables: list) -> None:
+def set_meta_values(conn: sqlite3.Connection, values: Dict[str, str]) -> None:
+    """
+    Store values in the meta table of the SQLite database, in a single transaction.
+
+    Parameters:
+    - conn (sqlite3.Connection): Connection to the SQLite database.
+    - values (Dict[str, str]): Values to store, by key.
+    """
+
+    with conn:
+        conn.executemany(
+            "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            values.items())
+
+
+def create_stock_tables(conn: sqlite3.Connection, tables: list) -> None:
     """
     Check if specific tables exist in the SQLite database file and create them if needed.
 
     Parameters:
-    - db_file_path (str): The path to the SQLite database file.
+    - conn (sqlite3.Connection): Connection to the SQLite database.
     - tables (list): A list of table names to check and create if needed.
-    """
 
-    # Dictionary to map intervals to column definitions
-    interval_columns = {
-        '1m': 'Datetime TEXT PRIMARY KEY, Open REAL, High REAL, Low REAL, Close REAL, "Adj Close" REAL, Volume INTEGER',
-        '2m': 'Datetime TEXT PRIMARY KEY, Open REAL, High REAL, Low REAL, Close REAL, "Adj Close" REAL, Volume INTEGER',
-        '5m': 'Datetime TEXT PRIMARY KEY, Open REAL, High REAL, Low REAL, Close REAL, "Adj Close" REAL, Volume INTEGER',
-        '15m': 'Datetime TEXT PRIMARY KEY, Open REAL, High REAL, Low REAL, Close REAL, "Adj Close" REAL, Volume INTEGER',
-        '30m': 'Datetime TEXT PRIMARY KEY, Open REAL, High REAL, Low REAL, Close REAL, "Adj Close" REAL, Volume INTEGER',
-        '60m': 'Datetime TEXT PRIMARY KEY, Open REAL, High REAL, Low REAL, Close REAL, "Adj Close" REAL, Volume INTEGER',
-        '90m': 'Datetime TEXT PRIMARY KEY, Open REAL, High REAL, Low REAL, Close REAL, "Adj Close" REAL, Volume INTEGER',
-        '1h': 'Datetime TEXT PRIMARY KEY, Open REAL, High REAL, Low REAL, Close REAL, "Adj Close" REAL, Volume INTEGER',
-        '1d': 'Date TEXT PRIMARY KEY, Open REAL, High REAL, Low REAL, Close REAL, "Adj Close" REAL, Volume INTEGER',
-        '5d': 'Date TEXT PRIMARY KEY, Open REAL, High REAL, Low REAL, Close REAL, "Adj Close" REAL, Volume INTEGER',
-        '1wk': 'Date TEXT PRIMARY KEY, Open REAL, High REAL, Low REAL, Close REAL, "Adj Close" REAL, Volume INTEGER',
-        '1mo': 'Date TEXT PRIMARY KEY, Open REAL, High REAL, Low REAL, Close REAL, "Adj Close" REAL, Volume INTEGER',
-        '3mo': 'Date TEXT PRIMARY KEY, Open REAL, High REAL, Low REAL, Close REAL, "Adj Close" REAL, Volume INTEGER'
-    }
+    Raises:
+    - sqlite3.Error: If the tables could not be created, once the partially run script has been rolled back.
+    """
 
     try:
-        # Connect to the SQLite database
-        conn = sqlite3.connect(db_file_path)
         cursor = conn.cursor()
 
+        # Get existing tables in the database with a single query
+        existing_tables = {table[0] for table in cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type='table'")}
+
+        # Build the statements creating the missing tables
+        queries = []
+        tables_to_create = []
         # Iterate through each specified table
         for table in tables:
-            # Check if the table exists
-            cursor.execute(
-                f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table}'")
-            existing_table = cursor.fetchone()
-
-            if existing_table is None:
+            if table in existing_tables:
+                # Table already exists, log a message
+                logger.info("Table '%s' already exists.", table)
+            elif not _IDENTIFIER_RE.match(table):
+                logger.error("Invalid table name '%s'.", table)
+            else:
                 # Table does not exist, create it
-                if table.endswith("_1d") or table.endswith("_5d") or table.endswith("_1wk") or table.endswith("_1mo") or table.endswith("_3mo"):
-                    interval = table.split("_")[1]
-                    if interval in interval_columns:
-                        column_definition = interval_columns[interval]
-                        query = f"CREATE TABLE {table} ({column_definition})"
-                        cursor.execute(query)
-                        print(f"Table '{table}' created successfully.")
-                    else:
-                        print(
-                            f"Error: Invalid interval '{interval}' for table '{table}'.")
-                elif table.endswith("_1m") or table.endswith("_2m") or table.endswith("_5m") or table.endswith("_15m") or table.endswith("_30m") or table.endswith("_60m") or table.endswith("_90m") or table.endswith("_1h"):
-                    interval = table.split("_")[1]
-                    if interval in interval_columns:
-                        column_definition = interval_columns[interval]
-                        query = f"CREATE TABLE {table} ({column_definition})"
-                        cursor.execute(query)
-                        print(f"Table '{table}' created successfully.")
-                    else:
-                        print(
-                            f"Error: Invalid interval '{interval}' for table '{table}'.")
+                interval = table.rsplit("_", 1)[-1]
+                if interval in _INTRADAY_INTERVALS:
+                    column_definition = _INTRADAY_COLUMNS
+                elif interval in _DAILY_INTERVALS:
+                    column_definition = _DAILY_COLUMNS
                 else:
-                    print(f"Error: Invalid table name '{table}'.")
-            else:
-                # Table already exists, print a message
-                print(f"Table '{table}' already exists.")
+                    logger.error(
+                        "Invalid interval '%s' for table '%s'.", interval, table)
+                    continue
+                # Without a rowid, rows are stored in a single B-tree ordered by date, instead of
+                # a rowid table plus a separate index on the date primary key
+                queries.append(
+                    f"CREATE TABLE IF NOT EXISTS {_quote_identifier(table)} ({column_definition}) WITHOUT ROWID;")
+                tables_to_create.append(table)
+
+        # Create the missing tables with a single script run in a single transaction
+        if queries:
+            cursor.executescript("BEGIN;\n" + "\n".join(queries) + "\nCOMMIT;")
+            for table in tables_to_create:
+                logger.info("Table '%s' created successfully.", table)
 
     except sqlite3.Error as e:
-        # Handle SQLite errors
-        print(f"SQLite error: {e}")
+        # Handle SQLite errors, undoing a partially run script, and let the caller decide whether to retry
+        logger.error("SQLite error: %s", e)
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+
+
+def download_stocks_data(tickers: List[str], interval: str, start_date: Union[str, datetime], max_workers: int = 16,
+                         session: requests.Session = None) -> Dict[str, pd.DataFrame]:
+    """
+    Download stock data for several tickers from Yahoo Finance in a single multi-symbol request.
+
+    Parameters:
+    - tickers (List[str]): Stock ticker symbols.
+    - interval (str): Data interval (e.g., '1d', '1h').
+    - start_date (Union[str, datetime]): Date or datetime from which to download data, or None to download up to today.
+    - max_workers (int): Maximum number of threads used by yfinance. Default value: 16
+    - session (requests.Session): HTTP session to reuse across requests. Default value: None
+
+    Returns:
+    - Dict[str, pd.DataFrame]: Open, High, Low, Close, Adj Close and Volume columns indexed by date, per ticker.
+    """
+
+    import pandas as pd
+    import yfinance as yf
+
+    # Download data from start_date until end_date using Yahoo Finance API.
+    # ignore_tz makes each ticker's index naive in its own exchange time before the tickers are combined,
+    # otherwise tickers from different exchanges would be converted to UTC.
+    # auto_adjust is disabled explicitly so that the 'Adj Close' column is always returned
+    if start_date is not None:
+        raw = yf.download(tickers=tickers, interval=interval, start=start_date, ignore_tz=True, auto_adjust=False,
+                          group_by='ticker', threads=max_workers, progress=False, session=session)
+    else:
+        raw = yf.download(tickers=tickers, interval=interval, end=datetime.now().strftime("%Y-%m-%d"), ignore_tz=True,
+                          auto_adjust=False, group_by='ticker', threads=max_workers, progress=False, session=session)
+
+    # A single ticker comes back with flat columns, several tickers with one column group per ticker
+    # (or with no columns at all when every download failed)
+    if not isinstance(raw.columns, pd.MultiIndex):
+        if len(tickers) == 1:
+            return {tickers[0]: raw}
+        downloaded_tickers = []
+    else:
+        downloaded_tickers = raw.columns.unique(level=0)
+
+    # Split the wide DataFrame back per ticker, dropping the dates only traded by other tickers
+    data = {}
+    for ticker in tickers:
+        if ticker.upper() in downloaded_tickers:
+            data[ticker] = raw[ticker.upper()].dropna(how='all')
+        else:
+            data[ticker] = pd.DataFrame(columns=['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume'],
+                                        index=pd.DatetimeIndex([]))
+    return data
 
-    finally:
-        # Close the database connection
-        if conn:
-            conn.close()
 
+def _download_batch(tickers: List[str], interval: str, start_date: Union[str, datetime], max_workers: int,
+                    session: requests.Session) -> Tuple[Dict[str, pd.DataFrame], Set[str]]:
+    """
+    Download stock data for a batch of tickers and find the tickers whose download failed because of network errors.
+
+    Parameters:
+    - tickers (List[str]): Stock ticker symbols.
+    - interval (str): Data interval (e.g., '1d', '1h').
+    - start_date (Union[str, datetime]): Date or datetime from which to download data.
+    - max_workers (int): Maximum number of threads used by yfinance.
+    - session (requests.Session): HTTP session to reuse across requests.
+
+    Returns:
+    - Tuple[Dict[str, pd.DataFrame], Set[str]]: The data downloaded per ticker, and the tickers whose download
+      failed because of network errors.
+    """
+    import yfinance as yf
+
+    data = download_stocks_data(tickers, interval, start_date, max_workers, session)
+
+    # yfinance resets its errors on each download, so they must be read before the next batch is downloaded
+    errors = yf.shared._ERRORS
+    failed_tickers = {ticker for ticker in tickers
+                      if _NETWORK_ERROR_RE.search(str(errors.get(ticker.upper(), '')))}
+    return data, failed_tickers
+
+
+def write_stock_data(conn: sqlite3.Connection, table_name: str, column_name: str, df: pd.DataFrame) -> None:
+    """
+    Write downloaded stock data to a SQLite table, updating the rows already stored for the same dates.
+
+    The rows are written within the current transaction, which the caller is responsible for committing.
+
+    Parameters:
+    - conn (sqlite3.Connection): Connection to the SQLite database.
+    - table_name (str): Name of the table to write to.
+    - column_name (str): Name of the date column ('Date' or 'Datetime').
+    - df (pd.DataFrame): Downloaded stock data.
+    """
 
-def update_stock_data(db_file_path: str) -> None:
+    cursor = conn.cursor()
+
+    # Write the data to the SQLite table with a single statement, if there is any data.
+    # The primary key on the date column lets SQLite update the rows already stored in place,
+    # which also refreshes the last (possibly incomplete) record.
+    if not df.empty:
+        # Format the index based on the column name in one vectorized pass, leaving the DataFrame untouched
+        dates = df.index.strftime(
+            "%Y-%m-%d" if column_name == 'Date' else "%Y-%m-%d %H:%M:%S").to_numpy()
+        # Stream the rows straight from the DataFrame columns, which yield Python scalars, without copying them
+        rows = zip(dates, *(df[column] for column in ['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']))
+        cursor.executemany(
+            f'INSERT INTO {_quote_identifier(table_name)} '
+            f'({_quote_identifier(column_name)}, Open, High, Low, Close, "Adj Close", Volume) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?) '
+            f'ON CONFLICT({_quote_identifier(column_name)}) DO UPDATE SET '
+            'Open = excluded.Open, High = excluded.High, Low = excluded.Low, Close = excluded.Close, '
+            '"Adj Close" = excluded."Adj Close", Volume = excluded.Volume', rows)
+
+
+def update_stock_data(conn: sqlite3.Connection, batch_size: int = 200, max_workers: int = 16,
+                      session: requests.Session = None, tables: List[str] = None) -> None:
     """
     Update stock data in SQLite tables based on intervals of existing tables.
 
+    Tables sharing the same interval and start date are downloaded together with multi-symbol
+    requests on a background thread, while writes stay on the calling thread so that SQLite
+    keeps a single writer.
+
     Parameters:
-    - db_file_path (str): The path to the SQLite database file.
+    - conn (sqlite3.Connection): Connection to the SQLite database.
+    - batch_size (int): Maximum number of tickers per Yahoo Finance request. Default value: 200
+    - max_workers (int): Maximum number of threads used by yfinance per request. Default value: 16
+    - session (requests.Session): HTTP session to reuse across requests. Default value: None
+    - tables (List[str]): Names of the tables to update, or None to update all of them. Default value: None
+
+    Raises:
+    - sqlite3.Error: If reading or writing the database failed, once the current batch has been rolled back.
+    - DownloadError: If the data of some tables could not be downloaded because of network errors, once the
+      data of the other tables has been written.
     """
-    
+
     try:
-        # Connect to the SQLite database
-        conn = sqlite3.connect(db_file_path)
         cursor = conn.cursor()
 
         # Get existing tables in the database
@@ -212,111 +429,144 @@ def update_stock_data(db_file_path: str) -> None:
         # Determine intervals to update based on existing tables
         intervals_to_update = set()
         for table_name in existing_tables:
-            _, interval = table_name.split("_")
-            intervals_to_update.add(interval)
+            intervals_to_update.add(table_name.rsplit("_", 1)[-1])
 
         # Check for valid intervals
-        valid_intervals = {'1m', '2m', '5m', '15m', '30m',
-                           '60m', '90m', '1h', '1d', '5d', '1wk', '1mo', '3mo'}
-        intervals_to_update = list(
-            valid_intervals.intersection(intervals_to_update))
-
-        # Proceed with updating data for each existing table
+        intervals_to_update &= _INTRADAY_INTERVALS | _DAILY_INTERVALS
+
+        # Define the maximum allowed period for each interval
+        max_nbr_days_dict = {
+            '1m': 7,
+            '2m': 60,
+            '5m': 60,
+            '15m': 60,
+            '30m': 60,
+            '60m': 730,
+            '90m': 60,
+            '1h': 730,
+            '1d': None,
+            '5d': None,
+            '1wk': None,
+            '1mo': None,
+            '3mo': None
+        }
+
+        # Only update the requested tables, if any
+        if tables is not None:
+            requested_tables = set(tables)
+            existing_tables = [table_name for table_name in existing_tables if table_name in requested_tables]
+
+        # Phase 1: select the tables to update
+        tables_to_update = []
         for table_name in existing_tables:
-            if any(table_name.endswith(interval) for interval in intervals_to_update):
-                ticker, interval = table_name.split("_")
+            if not _IDENTIFIER_RE.match(table_name):
+                logger.error("Invalid table name '%s', skipping it.", table_name)
+            elif table_name.rsplit("_", 1)[-1] in intervals_to_update:
+                ticker, interval = table_name.rsplit("_", 1)
                 ticker = ticker.replace('$', '-')
-                column_name = 'Datetime' if interval in [
-                    '1m', '2m', '5m', '15m', '30m', '60m', '90m', '1h'] else 'Date'
-                
-                    # Define the maximum allowed period for each interval
-                max_nbr_days_dict = {
-                    '1m': 7,
-                    '2m': 60,
-                    '5m': 60,
-                    '15m': 60,
-                    '30m': 60,
-                    '60m': 730,
-                    '90m': 60,
-                    '1h': 730,
-                    '1d': None,
-                    '5d': None,
-                    '1wk': None,
-                    '1mo': None,
-                    '3mo': None
-                }
-
-                # Calculate start_date based on current date and maximum allowed period
-                max_period = max_nbr_days_dict.get(interval, None)
-
-                # Check if the table is empty
-                cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
-                count = cursor.fetchone()[0]
-
-                if count == 0:
-                    # Table is empty, download data from '2022-01-01' until now
-                    if max_period is not None:
-                        start_date = (datetime.now() - timedelta(days=max_period-1)).strftime("%Y-%m-%d")
-                    else:
-                        start_date = datetime.now() - pd.DateOffset(365 * 10)
+                column_name = 'Datetime' if interval in _INTRADAY_INTERVALS else 'Date'
+                tables_to_update.append((table_name, ticker, interval, column_name))
+
+        # Check if the tables are empty and get their last date or datetime, with one UNION ALL query
+        # per chunk of tables (SQLite limits the number of terms in a compound SELECT to 500)
+        table_stats = {}
+        for i in range(0, len(tables_to_update), 500):
+            chunk = tables_to_update[i:i + 500]
+            query = " UNION ALL ".join(
+                f"SELECT ?, COUNT(*), MAX({_quote_identifier(column_name)}) FROM {_quote_identifier(table_name)}"
+                for table_name, _, _, column_name in chunk)
+            for table_name, count, last_record in cursor.execute(query, [table_name for table_name, _, _, _ in chunk]):
+                table_stats[table_name] = (count, last_record)
+
+        # Work out what to download for each table
+        pending_updates = []
+        for table_name, ticker, interval, column_name in tables_to_update:
+            count, last_record = table_stats[table_name]
+
+            # Calculate start_date based on current date and maximum allowed period
+            max_period = max_nbr_days_dict.get(interval, None)
+
+            if count > 0 and last_record is not None:
+                # Table is not empty, download data from the last date or datetime until now, so that only
+                # the new records and the last (possibly incomplete) one are fetched again.
+                # Records are written with a fixed format, so strptime is enough to parse them
+                if column_name == 'Date':
+                    start_date = last_record
                 else:
-                    # Table is not empty, get the last date or datetime
-                    cursor.execute(
-                        f"SELECT MAX({column_name}) FROM {table_name}")
-                    last_record = cursor.fetchone()[0]
-
-                    if last_record is not None:
-                        last_date_or_datetime = dateutil.parser.parse(
-                            last_record)
-                        last_date_or_datetime = last_date_or_datetime.replace(
-                            tzinfo=None)  # Remove timezone info
-                        start_date = (last_date_or_datetime + timedelta(days=0)).strftime(
-                            "%Y-%m-%d")
+                    # Datetimes are downloaded with ignore_tz, so they are stored as naive times of the ticker's
+                    # own exchange, which is also the timezone yfinance assumes for a naive start datetime
+                    start_date = datetime.strptime(last_record, "%Y-%m-%d %H:%M:%S")
+            elif max_period is not None:
+                # Table is empty, download data for the maximum allowed period
+                start_date = (datetime.now() - timedelta(days=max_period-1)).strftime("%Y-%m-%d")
+            else:
+                # Table is empty, download the last 10 years of data
+                start_date = (datetime.now() - timedelta(days=365 * 10)).strftime("%Y-%m-%d")
+
+            pending_updates.append(
+                (table_name, ticker, interval, column_name, start_date))
+
+        # Phase 2: group the updates sharing interval and start date, so they can be downloaded together
+        grouped_updates = {}
+        for update in pending_updates:
+            _, _, interval, _, start_date = update
+            grouped_updates.setdefault((interval, start_date), []).append(update)
+
+        # Phase 3: split each group in batches of tickers
+        batches = [(interval, start_date, updates[i:i + batch_size])
+                   for (interval, start_date), updates in grouped_updates.items()
+                   for i in range(0, len(updates), batch_size)]
+
+        # Phase 4: download the next batch on a background thread while this thread writes the data of the
+        # current one to the database. Batches are downloaded one after the other, since yf.download is
+        # not reentrant, and SQLite keeps a single writer
+        pool = ThreadPoolExecutor(max_workers=1)
+
+        def submit_download(i):
+            # Start downloading the i-th batch, if there is one
+            if i >= len(batches):
+                return None
+            interval, start_date, batch = batches[i]
+            return pool.submit(_download_batch, [ticker for _, ticker, _, _, _ in batch],
+                               interval, start_date, max_workers, session)
+
+        try:
+            # Only one download is in flight at a time, so at most two batches of data are held in memory
+            future = submit_download(0)
+            failed_tables = []
+            for i, (_, _, batch) in enumerate(batches):
+                data, failed_tickers = future.result()
+                future = submit_download(i + 1)
+
+                # yfinance logs download errors and returns empty data instead of raising. Tickers that failed
+                # because of network errors are left for a later attempt, while tickers without data for other
+                # reasons (e.g. delisted symbols) are skipped, since retrying would not help
+                failed_tables += [table_name for table_name, ticker, _, _, _ in batch if ticker in failed_tickers]
+                batch = [update for update in batch if update[1] not in failed_tickers]
+
+                # Write the whole batch in a single transaction, taking the write lock up front
+                with conn:
+                    cursor.execute("BEGIN IMMEDIATE")
+                    for table_name, ticker, _, column_name, _ in batch:
+                        write_stock_data(conn, table_name, column_name, data[ticker])
+
+                for table_name, ticker, _, _, _ in batch:
+                    if data[ticker].empty:
+                        logger.warning("No data downloaded for table '%s'.", table_name)
                     else:
-                        if max_period is not None:
-                            start_date = (datetime.now() - timedelta(days=max_period-1)).strftime("%Y-%m-%d")
-                        else:
-                            start_date = start_date = datetime.now() - pd.DateOffset(365 * 10)
-
-                # Download data from start_date until end_date using Yahoo Finance API
-                if start_date is not None:
-                    df = yf.download(ticker, interval=interval, start=start_date)
-                else:
-                    df = yf.download(ticker, interval=interval, end=datetime.now().strftime("%Y-%m-%d"))
+                        logger.info("Data for table '%s' updated successfully.", table_name)
+        finally:
+            # Do not keep downloading if writing failed
+            pool.shutdown(cancel_futures=True)
 
-                # Format the index based on the column name
-                df.index = df.index.strftime(
-                    "%Y-%m-%d" if column_name == 'Date' else "%Y-%m-%d %H:%M:%S")
-
-                # Remove the last record from the table
-                cursor.execute(
-                    f"DELETE FROM {table_name} WHERE ROWID = (SELECT MAX(ROWID) FROM {table_name})")
-                conn.commit()
-
-                # Check if the data already exists in the table
-                existing_data = pd.read_sql(
-                    f"SELECT {column_name} FROM {table_name}", conn)
-
-                existing_dates = set(existing_data[column_name])
-
-                # Filter out existing dates from the new data
-                df_to_append = df[~df.index.isin(existing_dates)]
-
-                # Append the new data to the SQLite table, if there is any new data
-                if not df_to_append.empty:
-                    df_to_append.to_sql(
-                        table_name, conn, if_exists='append', index=True, index_label=column_name)
-
-                print(f"Data for table '{table_name}' updated successfully.")
+        if failed_tables:
+            raise DownloadError(f"Network errors while downloading the data of {len(failed_tables)} tables.",
+                                failed_tables)
 
     except sqlite3.Error as e:
-        # Handle SQLite errors
-        print(f"SQLite error: {e}")
-
-    finally:
-        # Close the database connection
-        if conn:
-            conn.close()
+        # Log SQLite errors and let the caller decide whether to retry
+        logger.error("SQLite error: %s", e)
+        raise
 
 # def update_stock_data(db_file_path: str) -> None:
 #     """
@@ -1,9 +1,67 @@
+import contextlib
+from datetime import datetime, timezone
+import hashlib
 import logging
+import os
+import random
+import sqlite3
 import time
-from db_funcs import *
+from typing import Union
+import requests
+from requests.adapters import HTTPAdapter
+from db_funcs import (get_stocks_tickers_and_intervals, filter_available_tickers, create_or_connect_to_database,
+                      create_stock_tables, update_stock_data, get_meta_value, set_meta_values, DownloadError)
 
+# Tables of tickers such as 'BRK-B' are named with '$' instead of '-' (e.g. 'BRK$B_1d')
+_TICKER_TRANS = str.maketrans({"-": "$"})
 
-def run(json_file_path: str, db_file_path: str, check_available_tickers: bool = False) -> None:
+
+def prefetch_file(file_path: str) -> None:
+    """
+    Hint the operating system to start reading a file into the page cache ahead of its use.
+
+    Does nothing if the file doesn't exist or the platform lacks posix_fadvise (e.g. Windows, macOS).
+
+    Args:
+        file_path (str): Path to the file.
+
+    Returns:
+        None
+    """
+    if not hasattr(os, 'posix_fadvise') or not os.path.exists(file_path):
+        return
+
+    fd = os.open(file_path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    finally:
+        os.close(fd)
+
+
+def file_digest(file_path: str) -> Union[str, None]:
+    """
+    Compute a digest of the contents of a file.
+
+    Args:
+        file_path (str): Path to the file.
+
+    Returns:
+        Union[str, None]: Hexadecimal digest of the file, or None if the file doesn't exist.
+    """
+    try:
+        with open(file_path, 'rb') as file:
+            # Hash the file in fixed-size chunks, so that it is never loaded in memory at once
+            digest = hashlib.blake2b(digest_size=16)
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+            return digest.hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def run(json_file_path: str, db_file_path: str, check_available_tickers: bool = False,
+        skip_if_unchanged: bool = False) -> None:
     """
     Run the main processing flow.
 
@@ -11,6 +69,7 @@ def run(json_file_path: str, db_file_path: str, check_available_tickers: bool =
         json_file_path (str): Path to the JSON file.
         db_file_path (str): Path to the SQLite database file.
         check_available_tickers (bool): Filter a list of stock tickers to include only those available on Yahoo Finance. Default value: False
+        skip_if_unchanged (bool): Do nothing if the JSON file is unchanged since the last successful run and that run happened today (UTC). Intraday data is then not refreshed again until the next day. Default value: False
 
     Returns:
         None
@@ -18,50 +77,99 @@ def run(json_file_path: str, db_file_path: str, check_available_tickers: bool =
     # Set the maximum number of retry attempts
     max_retries = 15
 
-    # Set the interval (in seconds) between retry attempts
+    # Set the base interval (in seconds) between retry attempts, doubled after each attempt
     retry_interval = 15
 
-    # Loop through retry attempts
-    for attempt in range(1, max_retries + 1):
-        try:
-            # Fetch stock tickers and intervals from the JSON file
-            stocks_tickers_intervals_list = get_stocks_tickers_and_intervals(
-                json_file_path)
-
-            # Filter a list of stock tickers to include only those available on Yahoo Finance.
-            if check_available_tickers:
-                stocks_tickers_intervals_available_list = filter_available_tickers(
-                    stocks_tickers_intervals_list)
-            else:
-                stocks_tickers_intervals_available_list = stocks_tickers_intervals_list
-
-            # Create or connect to the SQLite database
-            create_or_connect_to_database(db_file_path)
-
-            # Create stock tables in the database based on intervals
-            tables_list = [table.replace(
-                "-", "$") for table in stocks_tickers_intervals_available_list]
-            create_stock_tables(
-                db_file_path, tables=tables_list)
-
-            # Update stock data in the database
-            update_stock_data(db_file_path)
-
-            # Successful execution, exit the loop
-            break
-        except Exception as e:
-            # Log an error message for the current attempt
-            logging.error(
-                f"Attempt {attempt}/{max_retries} failed. Error: {str(e)}")
-
-            # If it's not the last attempt, log a message and wait before retrying
-            if attempt < max_retries:
-                logging.info(f"Retrying in {retry_interval} seconds...")
-                time.sleep(retry_interval)
-            else:
-                # Max retries reached, log an error and exit the loop
-                logging.error("Max retries reached. Exiting.")
+    # Set the maximum interval (in seconds) between retry attempts
+    max_retry_interval = 300
+
+    # Start reading the JSON and database files from disk while the rest of the setup runs
+    prefetch_file(json_file_path)
+    prefetch_file(db_file_path)
+
+    # Fingerprint of the JSON file and current date, recorded after each successful run
+    json_digest = file_digest(json_file_path)
+    today = datetime.now(timezone.utc).date().isoformat()
+
+    # Create or connect to the SQLite database, sharing one connection across all attempts, and open an
+    # HTTP session whose connections to Yahoo Finance are kept alive across all downloads
+    with contextlib.closing(create_or_connect_to_database(db_file_path)) as conn, requests.Session() as session:
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32)
+        session.mount("https://", adapter)
+
+        # Skip the run if the same JSON file was already processed successfully today
+        if skip_if_unchanged and json_digest is not None and \
+                get_meta_value(conn, 'json_digest') == json_digest and \
+                get_meta_value(conn, 'last_run_date') == today:
+            logging.info("Stocks file unchanged and data already updated today. Nothing to do.")
+            return
+
+        # Fetch stock tickers and intervals from the JSON file, once for all attempts
+        stocks_tickers_intervals_list = get_stocks_tickers_and_intervals(
+            json_file_path)
+
+        # Tables left to update after an attempt failed because of network errors, or None to update all of them
+        tables_to_update = None
+
+        # Whether the stock tables are set up, which only needs to succeed once since they depend on the
+        # JSON file alone
+        tables_ready = False
+
+        # Loop through retry attempts
+        for attempt in range(1, max_retries + 1):
+            try:
+                if not tables_ready:
+                    # Filter a list of stock tickers to include only those available on Yahoo Finance.
+                    if check_available_tickers:
+                        stocks_tickers_intervals_available_list = filter_available_tickers(
+                            stocks_tickers_intervals_list, session=session)
+                    else:
+                        stocks_tickers_intervals_available_list = stocks_tickers_intervals_list
+
+                    # Create stock tables in the database based on intervals. This raises if the tables
+                    # could not be created, so that the next attempt tries again
+                    tables_list = [table.translate(_TICKER_TRANS)
+                                   for table in stocks_tickers_intervals_available_list]
+                    create_stock_tables(
+                        conn, tables=tables_list)
+
+                    tables_ready = True
+
+                # Update stock data in the database, which raises if any download or write failed
+                update_stock_data(conn, session=session, tables=tables_to_update)
+
+                # Record the run, only reached once all the data was updated, so that a run ending on errors
+                # is never skipped by skip_if_unchanged
+                if json_digest is not None:
+                    set_meta_values(conn, {'json_digest': json_digest, 'last_run_date': today})
+
+                # Successful execution, exit the loop
                 break
+            except (requests.ConnectionError, requests.Timeout, sqlite3.OperationalError, DownloadError) as e:
+                # Only retry the tables whose data could not be downloaded, the other ones are up to date
+                if isinstance(e, DownloadError):
+                    tables_to_update = e.tables
+
+                # Log an error message for the current attempt
+                logging.error(
+                    f"Attempt {attempt}/{max_retries} failed. Error: {str(e)}")
+
+                # If it's not the last attempt, log a message and wait before retrying
+                if attempt < max_retries:
+                    # Back off exponentially, with some jitter so that retries from several runs do not line up
+                    delay = min(max_retry_interval, retry_interval * 2 ** attempt) + \
+                        random.uniform(0, retry_interval)
+                    logging.info(f"Retrying in {delay:.0f} seconds...")
+                    time.sleep(delay)
+                else:
+                    # Max retries reached, log an error and exit the loop
+                    logging.error("Max retries reached. Exiting.")
+                    break
+            except Exception as e:
+                # Errors other than network, download or database lock issues will not go away by retrying
+                logging.error(
+                    f"Attempt {attempt}/{max_retries} failed with a non-recoverable error: {str(e)}")
+                raise
 
 
 if __name__ == '__main__':
@@ -81,4 +189,4 @@ if __name__ == '__main__':
     # db_file_path = './yahoo_finance_stocks_to_explore.db'  # Path to the SQLite database file
 
     # Run the main function with specified file paths
-    run(json_file_path, db_file_path, False)
+    run(json_file_path, db_file_path, check_available_tickers=False)